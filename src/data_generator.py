@@ -7,7 +7,7 @@ as CSV files for Spark Structured Streaming to process.
 Features:
 - Configurable event rate (events per second)
 - Multiple event types: view, add_to_cart, purchase
-- Realistic product data using Faker library
+- Realistic product data from a built-in catalog
 - Logging for monitoring
 - Graceful shutdown handling
 
@@ -19,24 +19,40 @@ Author: E-commerce Pipeline Project
 """
 
 import os
-import csv
 import uuid
 import time
 import random
 import signal
+import threading
 import logging
 import argparse
 from datetime import datetime
 from typing import List, Dict, Optional
+from bisect import bisect_left
+from itertools import accumulate
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Try to import NumPy for vectorized batch generation. The Docker
+# image installs it, so the vectorized path is the normal one; the
+# pure-Python fallback only keeps the generator usable outside the
+# image, e.g. on a bare host or under an alternative interpreter
+# like PyPy
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("Warning: NumPy not installed. Using pure-Python batch generation.")
 
-# Try to import Faker, provide fallback if not available
+# Try to import PyArrow, needed only for the optional Parquet output
+# format (EVENTS_FORMAT=parquet); CSV output has no extra dependency
 try:
-    from faker import Faker
-    fake = Faker()
-    FAKER_AVAILABLE = True
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
 except ImportError:
-    FAKER_AVAILABLE = False
-    print("Warning: Faker not installed. Using basic random data generation.")
+    PYARROW_AVAILABLE = False
 
 # ============================================================
 # Configuration
@@ -92,6 +108,43 @@ CATEGORIES = {
     ]
 }
 
+# ============================================================
+# Precomputed Catalog Arrays (for vectorized generation)
+# ============================================================
+# Flattening the catalog once at import time lets generate_batch
+# draw all products, prices and event types for a whole batch with
+# a handful of NumPy calls instead of per-event Python loops.
+
+# Dedicated RNG instance for the scalar helpers: the module-level
+# random functions share one global instance behind a lock, while a
+# private Random() has the same API without the contention.
+_rng = random.Random()
+
+# Flat list of (category, product_name, min_price, max_price)
+PRODUCTS = [
+    (category, name, min_price, max_price)
+    for category, items in CATEGORIES.items()
+    for name, min_price, max_price in items
+]
+
+EVENT_TYPE_LIST = list(EVENT_TYPES.keys())
+EVENT_TYPE_WEIGHTS = list(EVENT_TYPES.values())
+
+# Cumulative probabilities for the scalar path, e.g. [0.6, 0.9, 1.0]:
+# one binary search replaces a linear scan over EVENT_TYPES.items()
+EVENT_TYPE_CDF = list(accumulate(EVENT_TYPE_WEIGHTS))
+
+if NUMPY_AVAILABLE:
+    rng = np.random.default_rng()
+
+    PRODUCT_CATEGORIES = np.array([p[0] for p in PRODUCTS], dtype=object)
+    PRODUCT_NAMES = np.array([p[1] for p in PRODUCTS], dtype=object)
+    PRODUCT_MIN_PRICES = np.array([p[2] for p in PRODUCTS])
+    PRODUCT_MAX_PRICES = np.array([p[3] for p in PRODUCTS])
+
+    EVENT_TYPE_NAMES = np.array(EVENT_TYPE_LIST, dtype=object)
+    EVENT_TYPE_PROBS = np.array(EVENT_TYPE_WEIGHTS)
+
 # ============================================================
 # Setup Logging
 # ============================================================
@@ -143,16 +196,17 @@ def setup_logging() -> logging.Logger:
 logger = setup_logging()
 
 # ============================================================
-# Global flag for graceful shutdown
+# Graceful shutdown event
 # ============================================================
+# Checked once per batch (not per event) in the generator loop;
+# batches are generated in one shot, so this loses no responsiveness.
 
-shutdown_requested = False
+_shutdown = threading.Event()
 
 def signal_handler(signum, frame):
     """Handle shutdown signals gracefully."""
-    global shutdown_requested
     logger.info("Shutdown signal received. Finishing current batch...")
-    shutdown_requested = True
+    _shutdown.set()
 
 # Register signal handlers
 signal.signal(signal.SIGINT, signal_handler)
@@ -162,11 +216,22 @@ signal.signal(signal.SIGTERM, signal_handler)
 # Event Generation Functions
 # ============================================================
 
+# Timestamps have second resolution, so within a tight loop the
+# formatted string is almost always identical. Cache it and only
+# re-format when the integer second changes.
+_ts_cache = [0, ""]
+
+def _now_str() -> str:
+    """Current time as 'YYYY-MM-DD HH:MM:SS', cached per second."""
+    second = int(time.time())
+    if second != _ts_cache[0]:
+        _ts_cache[0] = second
+        _ts_cache[1] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+    return _ts_cache[1]
+
 def generate_user_id() -> str:
     """Generate a realistic user ID."""
-    if FAKER_AVAILABLE:
-        return f"user_{fake.uuid4()[:8]}"
-    return f"user_{uuid.uuid4().hex[:8]}"
+    return f"user_{os.urandom(4).hex()}"
 
 def generate_product_id() -> str:
     """Generate a unique product ID."""
@@ -174,19 +239,14 @@ def generate_product_id() -> str:
 
 def select_event_type() -> str:
     """Select an event type based on configured probabilities."""
-    rand = random.random()
-    cumulative = 0
-    for event_type, probability in EVENT_TYPES.items():
-        cumulative += probability
-        if rand <= cumulative:
-            return event_type
-    return 'view'  # Default fallback
+    return EVENT_TYPE_LIST[bisect_left(EVENT_TYPE_CDF, _rng.random())]
 
 def select_product() -> tuple:
-    """Select a random product from the catalog."""
-    category = random.choice(list(CATEGORIES.keys()))
-    product_name, min_price, max_price = random.choice(CATEGORIES[category])
-    price = round(random.uniform(min_price, max_price), 2)
+    """Select a random product from the flattened catalog."""
+    # Indexing the precomputed PRODUCTS list avoids rebuilding the
+    # category key list on every call
+    category, product_name, min_price, max_price = PRODUCTS[_rng.randrange(len(PRODUCTS))]
+    price = round(_rng.uniform(min_price, max_price), 2)
     return category, product_name, price
 
 def generate_event() -> Dict:
@@ -214,25 +274,117 @@ def generate_event() -> Dict:
         'category': category,
         'price': price,
         'event_type': select_event_type(),
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'timestamp': _now_str()
     }
 
+def _generate_batch_columns_np(n: int) -> Dict:
+    """Vectorized column generation (NumPy path)."""
+    # One draw per column instead of one draw per event
+    product_idx = rng.integers(0, len(PRODUCTS), size=n)
+    min_prices = PRODUCT_MIN_PRICES[product_idx]
+    max_prices = PRODUCT_MAX_PRICES[product_idx]
+    prices = np.round(min_prices + rng.random(n) * (max_prices - min_prices), 2)
+    event_types = rng.choice(EVENT_TYPE_NAMES, size=n, p=EVENT_TYPE_PROBS)
+
+    # One urandom syscall for the whole batch: 16 bytes for the
+    # event_id, 4 for the user_id suffix, 4 for the product_id suffix
+    raw = os.urandom(24 * n)
+
+    return {
+        'event_id': [raw[i * 24:i * 24 + 16].hex() for i in range(n)],
+        'user_id': [f"user_{raw[i * 24 + 16:i * 24 + 20].hex()}" for i in range(n)],
+        'product_id': [f"prod_{raw[i * 24 + 20:i * 24 + 24].hex()}" for i in range(n)],
+        'product_name': PRODUCT_NAMES[product_idx],
+        'category': PRODUCT_CATEGORIES[product_idx],
+        'price': prices,
+        'event_type': event_types,
+        'timestamp': _now_str()
+    }
+
+def _generate_batch_columns_py(n: int) -> Dict:
+    """Pure-Python column generation (fallback when NumPy is absent)."""
+    products = [PRODUCTS[_rng.randrange(len(PRODUCTS))] for _ in range(n)]
+    raw = os.urandom(24 * n)
+
+    return {
+        'event_id': [raw[i * 24:i * 24 + 16].hex() for i in range(n)],
+        'user_id': [f"user_{raw[i * 24 + 16:i * 24 + 20].hex()}" for i in range(n)],
+        'product_id': [f"prod_{raw[i * 24 + 20:i * 24 + 24].hex()}" for i in range(n)],
+        'product_name': [p[1] for p in products],
+        'category': [p[0] for p in products],
+        'price': [round(_rng.uniform(p[2], p[3]), 2) for p in products],
+        'event_type': _rng.choices(EVENT_TYPE_LIST, weights=EVENT_TYPE_WEIGHTS, k=n),
+        'timestamp': _now_str()
+    }
+
+def generate_batch_columns(batch_size: int) -> Dict:
+    """
+    Generate a batch of events as parallel columns (SoA layout).
+
+    All randomness for the batch (products, prices, event types)
+    is drawn in a few array operations, and each field is returned
+    as its own list/array instead of per-event dicts. This halves
+    per-event allocations and matches how the CSV writer consumes
+    the data. The 'timestamp' entry is a single string shared by
+    the whole batch (second resolution).
+
+    Uses NumPy when available; otherwise falls back to a pure-Python
+    path with the same output shape, so the generator can also run
+    under interpreters like PyPy where NumPy may not be installed.
+
+    Args:
+        batch_size: Number of events to generate
+
+    Returns:
+        Dict mapping column name -> list/array of values
+    """
+    if NUMPY_AVAILABLE:
+        return _generate_batch_columns_np(batch_size)
+    return _generate_batch_columns_py(batch_size)
+
 def generate_batch(batch_size: int) -> List[Dict]:
     """
-    Generate a batch of events.
-    
+    Generate a batch of events as a list of dicts.
+
+    Convenience wrapper over generate_batch_columns for callers
+    (and tests) that want row-shaped events; the hot path in
+    run_generator uses the columnar form directly.
+
     Args:
         batch_size: Number of events to generate
-        
+
     Returns:
         List of event dictionaries
     """
-    return [generate_event() for _ in range(batch_size)]
+    cols = generate_batch_columns(batch_size)
+    timestamp = cols['timestamp']
+    return [
+        {
+            'event_id': cols['event_id'][i],
+            'user_id': cols['user_id'][i],
+            'product_id': cols['product_id'][i],
+            'product_name': cols['product_name'][i],
+            'category': cols['category'][i],
+            'price': float(cols['price'][i]),
+            'event_type': cols['event_type'][i],
+            'timestamp': timestamp
+        }
+        for i in range(batch_size)
+    ]
 
 # ============================================================
 # File Writing Functions
 # ============================================================
 
+# CSV column order matters: it must match the Spark schema
+CSV_HEADER = 'event_id,user_id,product_id,product_name,category,price,event_type,timestamp\n'
+
+# Reused row buffer for the CSV writer. All writes go through the
+# single-worker writer pool (or the sync wrapper), so they never run
+# concurrently and one shared buffer avoids growing a fresh list for
+# every batch.
+_lines_buf: List[str] = []
+
 def get_output_directory() -> str:
     """Get the output directory path, creating it if needed."""
     # Determine base path (works in Docker and local)
@@ -248,109 +400,161 @@ def get_output_directory() -> str:
     os.makedirs(output_dir, exist_ok=True)
     return output_dir
 
-def write_events_to_csv(events: List[Dict], output_dir: str) -> str:
+def new_output_filepath(output_dir: str, extension: str = 'csv') -> str:
+    """Build a unique timestamped output path in the output directory."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    return os.path.join(output_dir, f"events_{timestamp}.{extension}")
+
+def write_csv_file(columns: Dict, filepath: str) -> str:
     """
-    Write a batch of events to a CSV file.
-    
+    Write a batch of events (columnar form) to the given CSV path.
+
+    This is the part run_generator hands to the background writer
+    thread; the filename is chosen by the caller so it can be logged
+    without waiting for the write to finish.
+
     Args:
-        events: List of event dictionaries
-        output_dir: Directory to write the file to
-        
+        columns: Column dict from generate_batch_columns
+        filepath: Destination CSV file path
+
     Returns:
         Path to the created file
     """
-    # Generate unique filename with timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    filename = f"events_{timestamp}.csv"
-    filepath = os.path.join(output_dir, filename)
-    
-    # Define CSV columns (order matters)
-    fieldnames = [
-        'event_id', 'user_id', 'product_id', 'product_name',
-        'category', 'price', 'event_type', 'timestamp'
-    ]
-    
-    # Write events to CSV
-    with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(events)
-    
+    # Our fields never contain commas, quotes or newlines (the catalog
+    # is fixed and IDs are hex), so the csv module's escaping machinery
+    # is pure overhead. Build the rows with f-strings and write the
+    # whole file in one call.
+    event_ids = columns['event_id']
+    user_ids = columns['user_id']
+    product_ids = columns['product_id']
+    names = columns['product_name']
+    categories = columns['category']
+    prices = columns['price']
+    event_types = columns['event_type']
+    ts = columns['timestamp']
+
+    lines = _lines_buf
+    lines.clear()
+    lines.append(CSV_HEADER)
+    lines_append = lines.append
+    for i in range(len(event_ids)):
+        lines_append(
+            f"{event_ids[i]},{user_ids[i]},{product_ids[i]},"
+            f"{names[i]},{categories[i]},{prices[i]:.2f},"
+            f"{event_types[i]},{ts}\n"
+        )
+
+    # 1 MiB buffer so even large batches leave in one write syscall;
+    # no explicit flush/fsync here - the close flushes once and the
+    # OS handles durability
+    with open(filepath, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(''.join(lines))
+
     return filepath
 
-# ============================================================
-# Rate Limiting
-# ============================================================
+def write_parquet_file(columns: Dict, filepath: str) -> str:
+    """
+    Write a batch of events (columnar form) to the given Parquet path.
+
+    Parquet stores the columns in compressed binary form, so the files
+    are smaller than CSV and Spark parses them without text-to-number
+    conversion. Requires PyArrow (EVENTS_FORMAT=parquet).
 
-class RateLimiter:
+    Args:
+        columns: Column dict from generate_batch_columns
+        filepath: Destination Parquet file path
+
+    Returns:
+        Path to the created file
     """
-    Simple rate limiter to control event generation rate.
-    
-    This ensures we generate exactly the specified number of
-    events per second, regardless of processing time.
+    n = len(columns['event_id'])
+    table = pa.Table.from_pydict({
+        'event_id': columns['event_id'],
+        'user_id': columns['user_id'],
+        'product_id': columns['product_id'],
+        'product_name': list(columns['product_name']),
+        'category': list(columns['category']),
+        'price': [float(p) for p in columns['price']],
+        'event_type': list(columns['event_type']),
+        'timestamp': [columns['timestamp']] * n
+    })
+    pq.write_table(table, filepath, compression='snappy')
+    return filepath
+
+def write_events_to_csv(columns: Dict, output_dir: str) -> str:
     """
-    
-    def __init__(self, events_per_second: int):
-        """
-        Initialize the rate limiter.
-        
-        Args:
-            events_per_second: Target rate of event generation
-        """
-        self.events_per_second = events_per_second
-        self.interval = 1.0 / events_per_second if events_per_second > 0 else 1.0
-        self.last_event_time = time.time()
-        self.events_this_second = 0
-        self.second_start = time.time()
-    
-    def wait(self):
-        """Wait if necessary to maintain the target rate."""
-        current_time = time.time()
-        
-        # Reset counter every second
-        if current_time - self.second_start >= 1.0:
-            self.events_this_second = 0
-            self.second_start = current_time
-        
-        # If we've hit the rate limit, wait until next second
-        if self.events_this_second >= self.events_per_second:
-            sleep_time = 1.0 - (current_time - self.second_start)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            self.events_this_second = 0
-            self.second_start = time.time()
-        
-        self.events_this_second += 1
+    Write a batch of events (columnar form) to a new CSV file.
+
+    Synchronous convenience wrapper around new_output_filepath +
+    write_csv_file.
+
+    Args:
+        columns: Column dict from generate_batch_columns
+        output_dir: Directory to write the file to
+
+    Returns:
+        Path to the created file
+    """
+    return write_csv_file(columns, new_output_filepath(output_dir))
 
 # ============================================================
 # Main Generator Loop
 # ============================================================
+# Rate limiting is done with one sleep per batch: after producing
+# N events we sleep until the wall-clock time at which the Nth
+# event was due (total_events / events_per_second since start).
+# This keeps the average rate exact with O(1) overhead per batch
+# instead of per-event time checks, and uses time.monotonic_ns so
+# clock jumps cannot cause negative sleeps.
 
 def run_generator(
     events_per_second: int = 10,
     batch_size: int = 10,
     duration: Optional[int] = None,
-    output_dir: Optional[str] = None
+    output_dir: Optional[str] = None,
+    file_format: Optional[str] = None
 ):
     """
     Main function to run the event generator.
-    
+
     Args:
         events_per_second: Number of events to generate per second
-        batch_size: Number of events per CSV file
+        batch_size: Number of events per output file
         duration: How long to run in seconds (None for indefinite)
         output_dir: Override output directory
+        file_format: 'csv' or 'parquet' (default: EVENTS_FORMAT env
+            var, falling back to 'csv')
     """
-    global shutdown_requested
-    
     # Setup
     if output_dir is None:
         output_dir = get_output_directory()
+
+    # Pick the output format; the Spark job reads the same
+    # EVENTS_FORMAT variable so both sides stay in sync
+    if file_format is None:
+        file_format = os.getenv('EVENTS_FORMAT', 'csv').lower()
+    if file_format == 'parquet' and not PYARROW_AVAILABLE:
+        # Never fall back silently: the Spark reader keys off the same
+        # EVENTS_FORMAT and would still expect Parquet files, so writing
+        # CSV here would break the pipeline rather than degrade it
+        raise RuntimeError(
+            "EVENTS_FORMAT=parquet requires PyArrow. "
+            "Install pyarrow or use the default csv format."
+        )
+    write_file = write_parquet_file if file_format == 'parquet' else write_csv_file
     
-    rate_limiter = RateLimiter(events_per_second)
     start_time = time.time()
+    start_ns = time.monotonic_ns()
     total_events = 0
     total_files = 0
+
+    # Background writer: CSV writes happen on this single thread so
+    # the generator never blocks on disk I/O. The pending deque is
+    # bounded so a slow disk applies backpressure instead of letting
+    # unwritten batches pile up in memory.
+    writer_pool = ThreadPoolExecutor(max_workers=1)
+    pending_writes = deque()
+    max_pending_writes = 4
     
     logger.info("=" * 60)
     logger.info("E-commerce Event Generator Started")
@@ -358,13 +562,14 @@ def run_generator(
     logger.info(f"Events per second: {events_per_second}")
     logger.info(f"Batch size: {batch_size}")
     logger.info(f"Output directory: {output_dir}")
+    logger.info(f"Output format: {file_format}")
     logger.info(f"Duration: {'Indefinite' if duration is None else f'{duration} seconds'}")
     logger.info("=" * 60)
     logger.info("Press Ctrl+C to stop gracefully")
     logger.info("")
     
     try:
-        while not shutdown_requested:
+        while not _shutdown.is_set():
             # Check duration limit
             if duration is not None:
                 elapsed = time.time() - start_time
@@ -372,42 +577,43 @@ def run_generator(
                     logger.info(f"Duration limit ({duration}s) reached.")
                     break
             
-            # Generate batch of events
+            # Generate all columns in one shot (no per-event waits)
             batch_start = time.time()
-            events = []
-            
-            for _ in range(batch_size):
-                if shutdown_requested:
-                    break
-                rate_limiter.wait()
-                events.append(generate_event())
-            
-            # Write to file
-            if events:
-                filepath = write_events_to_csv(events, output_dir)
-                total_events += len(events)
+            columns = generate_batch_columns(batch_size)
+            batch_events = len(columns['event_id'])
+
+            # Queue the write on the background thread
+            if batch_events:
+                filepath = new_output_filepath(output_dir, file_format)
+                pending_writes.append(
+                    writer_pool.submit(write_file, columns, filepath)
+                )
+                # Backpressure: block on the oldest write (and surface
+                # any write error) once too many are in flight
+                while len(pending_writes) > max_pending_writes:
+                    pending_writes.popleft().result()
+
+                total_events += batch_events
                 total_files += 1
                 batch_time = time.time() - batch_start
-                
+
                 # Calculate batch statistics
                 event_types = {}
-                total_price = 0
-                for evt in events:
-                    event_types[evt['event_type']] = event_types.get(evt['event_type'], 0) + 1
-                    total_price += evt['price']
-                avg_price = total_price / len(events)
-                
+                for evt_type in columns['event_type']:
+                    event_types[evt_type] = event_types.get(evt_type, 0) + 1
+                avg_price = float(sum(columns['price'])) / batch_events
+
                 # Log progress every file with detailed metrics
                 elapsed = time.time() - start_time
                 rate = total_events / elapsed if elapsed > 0 else 0
-                
+
                 # Main log line
                 logger.info(
                     f"File #{total_files}: {os.path.basename(filepath)} | "
-                    f"Events: {len(events)} | Total: {total_events} | "
+                    f"Events: {batch_events} | Total: {total_events} | "
                     f"Rate: {rate:.1f} evt/s"
                 )
-                
+
                 # Detailed metrics log line
                 type_dist = ", ".join([f"{k}:{v}" for k, v in event_types.items()])
                 logger.info(
@@ -415,12 +621,30 @@ def run_generator(
                     f"batch_time={batch_time:.3f}s | types=[{type_dist}] | "
                     f"avg_price=${avg_price:.2f} | elapsed={elapsed:.1f}s"
                 )
-    
+
+            # One sleep per batch: wait until the time at which the
+            # last event of this batch was due on the target schedule.
+            # Integer nanoseconds via monotonic_ns: cheaper to read
+            # than time.time() and free of float rounding drift.
+            if events_per_second > 0:
+                deadline_ns = start_ns + total_events * 1_000_000_000 // events_per_second
+                sleep_ns = deadline_ns - time.monotonic_ns()
+                if sleep_ns > 0:
+                    time.sleep(sleep_ns / 1_000_000_000)
+
     except Exception as e:
         logger.error(f"Error during generation: {e}")
         raise
     
     finally:
+        # Finish any queued writes before reporting
+        while pending_writes:
+            try:
+                pending_writes.popleft().result()
+            except Exception as e:
+                logger.error(f"Background CSV write failed: {e}")
+        writer_pool.shutdown(wait=True)
+
         # Print summary
         elapsed = time.time() - start_time
         logger.info("")
@@ -480,9 +704,17 @@ Examples:
         '--output-dir', '-o',
         type=str,
         default=None,
-        help='Output directory for CSV files (default: data/raw)'
+        help='Output directory for event files (default: data/raw)'
     )
-    
+
+    parser.add_argument(
+        '--format', '-f',
+        type=str,
+        choices=['csv', 'parquet'],
+        default=None,
+        help='Output file format (default: EVENTS_FORMAT env var or csv)'
+    )
+
     return parser.parse_args()
 
 # ============================================================
@@ -496,5 +728,6 @@ if __name__ == '__main__':
         events_per_second=args.events_per_second,
         batch_size=args.batch_size,
         duration=args.duration,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        file_format=args.format
     )
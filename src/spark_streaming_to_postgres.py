@@ -20,10 +20,14 @@ Author: E-commerce Pipeline Project
 """
 
 import os
+import random
+import socket
 import logging
+import threading
 import time
 from datetime import datetime
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 
 from pyspark.sql import SparkSession, DataFrame
 from pyspark.sql.functions import (
@@ -32,10 +36,19 @@ from pyspark.sql.functions import (
     to_timestamp, coalesce
 )
 from pyspark.sql.types import (
-    StructType, StructField, StringType, 
+    StructType, StructField, StringType,
     DoubleType, TimestampType
 )
 
+# Try to import psycopg2 for lightweight connection probes; without
+# it the retry loop relies on the TCP socket probe alone and the JDBC
+# check still runs once at the end
+try:
+    import psycopg2
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
 # ============================================================
 # Configuration
 # ============================================================
@@ -63,6 +76,10 @@ class Config:
     # Streaming settings
     TRIGGER_INTERVAL = "10 seconds"  # Process every 10 seconds
     MAX_FILES_PER_TRIGGER = 10       # Limit files processed per batch
+
+    # Input file format ('csv' or 'parquet'); must match the
+    # EVENTS_FORMAT the data generator writes with
+    SOURCE_FORMAT = os.getenv('EVENTS_FORMAT', 'csv').lower()
     
     # Valid event types
     VALID_EVENT_TYPES = ['view', 'add_to_cart', 'purchase']
@@ -71,6 +88,11 @@ class Config:
     MAX_RETRIES = 3
     RETRY_DELAY_SECONDS = 5
 
+    # Rows per JDBC insert batch. One prepared statement with N tuples
+    # replaces N single-row statements, so this dominates sink
+    # throughput on insert-heavy workloads.
+    JDBC_BATCH_SIZE = int(os.getenv('JDBC_BATCH_SIZE', '10000'))
+
 # ============================================================
 # Setup Logging
 # ============================================================
@@ -250,6 +272,29 @@ def prepare_for_postgres(df: DataFrame) -> DataFrame:
 # Database Operations
 # ============================================================
 
+def jdbc_url_with_keepalive() -> str:
+    """
+    JDBC URL with TCP keepalive and timeout parameters appended.
+
+    tcpKeepAlive=true enables SO_KEEPALIVE on the socket; the probe
+    timing follows the OS TCP_KEEPIDLE/TCP_KEEPINTVL settings. Without
+    it, a peer silently dropped by a NAT or firewall is only noticed
+    after the kernel default of about 2 hours, hanging the first
+    post-idle micro-batch. socketTimeout and loginTimeout bound
+    individual socket reads and the initial handshake.
+    """
+    return f"{Config.JDBC_URL}?tcpKeepAlive=true&socketTimeout=30&loginTimeout=5"
+
+def jdbc_write_url() -> str:
+    """
+    JDBC URL for the streaming sink.
+
+    Adds reWriteBatchedInserts=true on top of the keepalive settings:
+    pgjdbc then rewrites a batch of single-row INSERTs into multi-row
+    VALUES statements, cutting server round-trips per micro-batch.
+    """
+    return f"{jdbc_url_with_keepalive()}&reWriteBatchedInserts=true"
+
 def get_jdbc_properties() -> dict:
     """Get JDBC connection properties."""
     return {
@@ -308,15 +353,21 @@ def write_to_postgres_with_retry(batch_df: DataFrame, batch_id: int):
         try:
             write_start = time.time()
             
-            # Use 'append' mode - duplicates are handled by DB constraint
+            # Use 'append' mode - duplicates are handled by DB constraint.
+            # batchsize groups rows per prepared statement. The default
+            # per-partition transaction is kept deliberately: it makes a
+            # failed write roll back completely, so the retry below can
+            # re-insert the batch without the duplicate-key handler
+            # mistaking partially-committed data for success
             final_df.write \
                 .format("jdbc") \
-                .option("url", Config.JDBC_URL) \
+                .option("url", jdbc_write_url()) \
                 .option("dbtable", "user_events") \
                 .option("user", Config.POSTGRES_USER) \
                 .option("password", Config.POSTGRES_PASSWORD) \
                 .option("driver", "org.postgresql.Driver") \
                 .option("stringtype", "unspecified") \
+                .option("batchsize", str(Config.JDBC_BATCH_SIZE)) \
                 .mode("append") \
                 .save()
             
@@ -389,6 +440,7 @@ def start_streaming_job(spark: SparkSession):
     logger.info("Starting Spark Structured Streaming Job")
     logger.info("=" * 60)
     logger.info(f"Input path: {Config.INPUT_PATH}")
+    logger.info(f"Source format: {Config.SOURCE_FORMAT}")
     logger.info(f"Checkpoint path: {Config.CHECKPOINT_PATH}")
     logger.info(f"PostgreSQL URL: {Config.JDBC_URL}")
     logger.info(f"Trigger interval: {Config.TRIGGER_INTERVAL}")
@@ -399,17 +451,23 @@ def start_streaming_job(spark: SparkSession):
     os.makedirs(Config.ERROR_PATH, exist_ok=True)
     os.makedirs(Config.CHECKPOINT_PATH, exist_ok=True)
     
-    # Create streaming DataFrame from CSV files
+    # Create streaming DataFrame from the input files
     schema = get_event_schema()
-    
-    stream_df = spark.readStream \
-        .format("csv") \
-        .option("header", "true") \
+
+    stream_reader = spark.readStream \
+        .format(Config.SOURCE_FORMAT) \
         .option("maxFilesPerTrigger", Config.MAX_FILES_PER_TRIGGER) \
         .option("cleanSource", "delete") \
-        .option("mode", "DROPMALFORMED") \
-        .schema(schema) \
-        .load(Config.INPUT_PATH)
+        .schema(schema)
+
+    # Header and malformed-record handling only apply to text sources;
+    # Parquet embeds its schema and is validated at file level
+    if Config.SOURCE_FORMAT == "csv":
+        stream_reader = stream_reader \
+            .option("header", "true") \
+            .option("mode", "DROPMALFORMED")
+
+    stream_df = stream_reader.load(Config.INPUT_PATH)
     
     logger.info("Streaming DataFrame created. Waiting for data...")
     
@@ -436,78 +494,322 @@ def start_streaming_job(spark: SparkSession):
 # Health Check
 # ============================================================
 
-def test_postgres_connection(spark: SparkSession) -> bool:
+# Cached probe connection, reused across retries so each attempt is a
+# sub-millisecond SELECT 1 instead of a fresh TCP + auth handshake
+_probe_conn = None
+
+def _get_probe_connection():
+    """Get (or lazily create) the cached psycopg2 probe connection."""
+    global _probe_conn
+    if _probe_conn is None or _probe_conn.closed:
+        _probe_conn = psycopg2.connect(
+            host=Config.POSTGRES_HOST,
+            port=Config.POSTGRES_PORT,
+            dbname=Config.POSTGRES_DB,
+            user=Config.POSTGRES_USER,
+            password=Config.POSTGRES_PASSWORD,
+            connect_timeout=5,
+            # libpq keepalive knobs (map to TCP_KEEPIDLE/TCP_KEEPINTVL/
+            # TCP_KEEPCNT): probe after 30s idle, every 10s, give up
+            # after 3 missed probes
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _probe_conn
+
+def _close_probe_connection():
+    """Close the cached probe connection, ignoring errors."""
+    global _probe_conn
+    if _probe_conn is not None:
+        try:
+            _probe_conn.close()
+        except Exception:
+            pass
+        _probe_conn = None
+
+def _test_connection_psycopg2() -> bool:
+    """Probe PostgreSQL with SELECT 1 over the cached connection."""
+    try:
+        conn = _get_probe_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        return True
+    except Exception as e:
+        logger.error("PostgreSQL connection failed: %s", e)
+        # The connection may be half-dead; rebuild it on the next probe
+        _close_probe_connection()
+        return False
+
+def _test_connection_socket() -> bool:
+    """Probe PostgreSQL with a bare TCP connect (cheapest liveness check)."""
+    try:
+        conn = socket.create_connection(
+            (Config.POSTGRES_HOST, int(Config.POSTGRES_PORT)), timeout=2
+        )
+        conn.close()
+        return True
+    except OSError:
+        return False
+
+# JDBC probe reader, built once and reused: every fresh reader costs
+# option-map setup and Py4J round-trips before the actual connection
+_probe_reader = None
+
+def _build_probe_reader(spark: SparkSession):
+    """Build the SELECT 1 JDBC probe reader (done once, then cached)."""
+    return spark.read \
+        .format("jdbc") \
+        .option("url", jdbc_url_with_keepalive()) \
+        .option("query", "SELECT 1 as test") \
+        .option("user", Config.POSTGRES_USER) \
+        .option("password", Config.POSTGRES_PASSWORD) \
+        .option("driver", "org.postgresql.Driver")
+
+def _test_connection_jdbc(spark: SparkSession) -> bool:
+    """Probe PostgreSQL through the cached Spark JDBC reader."""
+    global _probe_reader
+    try:
+        if _probe_reader is None:
+            _probe_reader = _build_probe_reader(spark)
+
+        # limit(1).count() forces evaluation but returns a bare long,
+        # skipping the Row serialization back to Python that collect()
+        # would pay
+        _probe_reader.load().limit(1).count()
+        return True
+
+    except Exception as e:
+        logger.error("PostgreSQL connection failed: %s", e)
+        return False
+
+def test_postgres_connection(spark: Optional[SparkSession] = None) -> bool:
     """
     Test PostgreSQL connection before starting the stream.
-    
+
+    Starts with a bare TCP connect (one syscall, no Spark involved),
+    then confirms query readiness over the cached psycopg2 connection
+    when available - Postgres accepts TCP before it accepts queries
+    during startup. The heavyweight Spark JDBC path is checked exactly
+    once via verify_jdbc_path after this probe succeeds, not inside
+    the retry loop. The probe itself needs no Spark session, so the
+    spark argument is optional and kept for compatibility.
+
     Returns:
         True if connection successful, False otherwise
     """
     logger.info("Testing PostgreSQL connection...")
-    
-    try:
-        # Try to read from PostgreSQL
-        test_df = spark.read \
-            .format("jdbc") \
-            .option("url", Config.JDBC_URL) \
-            .option("query", "SELECT 1 as test") \
-            .option("user", Config.POSTGRES_USER) \
-            .option("password", Config.POSTGRES_PASSWORD) \
-            .option("driver", "org.postgresql.Driver") \
-            .load()
-        
-        test_df.collect()  # Force evaluation
-        logger.info("PostgreSQL connection successful!")
-        return True
-        
-    except Exception as e:
-        logger.error(f"PostgreSQL connection failed: {e}")
+
+    if not _test_connection_socket():
         return False
 
-def wait_for_postgres(spark: SparkSession, max_retries: int = 30, delay: int = 5):
+    ok = _test_connection_psycopg2() if PSYCOPG2_AVAILABLE else True
+
+    if ok:
+        logger.info("PostgreSQL connection successful!")
+    return ok
+
+def verify_jdbc_path(spark: SparkSession) -> bool:
     """
-    Wait for PostgreSQL to be available.
-    
-    Useful when starting containers, as Postgres may take time to initialize.
+    Confirm once that Spark itself can reach PostgreSQL over JDBC.
+
+    Called a single time after wait_for_postgres succeeds, so the
+    JVM driver-class loading cost is paid exactly once instead of on
+    every retry.
     """
-    logger.info("Waiting for PostgreSQL to be available...")
-    
+    logger.info("Verifying Spark JDBC connectivity...")
+    return _test_connection_jdbc(spark)
+
+def _wait_for_postgres_probe(total_timeout_s: float = 120.0, max_retries: int = 60,
+                             base: float = 0.5, cap: float = 30.0) -> bool:
+    """
+    Wait for PostgreSQL to answer the lightweight probe.
+
+    Spark-free on purpose: this can run while the Spark session is
+    still starting up. The loop is bounded primarily by a wall-clock
+    budget (total_timeout_s), with max_retries only as a secondary
+    guard. With jittered backoff the per-attempt delays vary, so an
+    attempt count alone could block far longer (or give up far
+    sooner) than the orchestrator's health-check window allows.
+
+    Retries with exponential backoff and full jitter: each failed
+    attempt sleeps a random amount in [0, min(cap, base * 2^attempt)],
+    clamped to the remaining budget. Short early delays make startup
+    fast when Postgres is almost ready, and the randomness keeps
+    simultaneously restarted containers from retrying against the
+    database in lockstep.
+    """
+    logger.info("Waiting for PostgreSQL to be available (budget: %.0fs)...", total_timeout_s)
+
+    deadline = time.monotonic() + total_timeout_s
+
     for attempt in range(1, max_retries + 1):
-        if test_postgres_connection(spark):
+        if test_postgres_connection():
             return True
-        
-        logger.info(f"Attempt {attempt}/{max_retries}: PostgreSQL not ready. Waiting {delay}s...")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        window = min(cap, base * (2 ** (attempt - 1)))
+        delay = min(random.uniform(0, window), remaining)
+        # %-style args so the string is only built if the level is on
+        logger.info(
+            "Attempt %d/%d: PostgreSQL not ready. Waiting %.2fs (%.0fs of budget left)...",
+            attempt, max_retries, delay, remaining
+        )
         time.sleep(delay)
-    
+
     logger.error("PostgreSQL did not become available in time!")
     return False
 
+def wait_for_postgres(spark: SparkSession, total_timeout_s: float = 120.0,
+                      max_retries: int = 60, base: float = 0.5, cap: float = 30.0):
+    """
+    Wait for PostgreSQL to be available.
+
+    Useful when starting containers, as Postgres may take time to initialize.
+    Runs the lightweight probe loop, then the one-off Spark JDBC check.
+    """
+    if not _wait_for_postgres_probe(total_timeout_s, max_retries, base, cap):
+        return False
+    return verify_jdbc_path(spark)
+
+def prewarm_postgres_connections(spark: SparkSession):
+    """
+    Warm up PostgreSQL connections before the stream starts.
+
+    The first JDBC operation on each JVM pays for loading the
+    Postgres driver class plus a TCP and auth handshake, which
+    otherwise lands on the first micro-batch as a latency spike.
+    This does that work up front: one small JDBC read on the driver,
+    and one short-lived connection per executor slot.
+    """
+    logger.info("Pre-warming PostgreSQL connections...")
+
+    # Driver side: a single JDBC read loads the driver class and
+    # fills the driver-side metadata caches
+    try:
+        spark.read \
+            .format("jdbc") \
+            .option("url", jdbc_url_with_keepalive()) \
+            .option("query", "SELECT 1 as warmup") \
+            .option("user", Config.POSTGRES_USER) \
+            .option("password", Config.POSTGRES_PASSWORD) \
+            .option("driver", "org.postgresql.Driver") \
+            .load() \
+            .limit(1) \
+            .count()
+    except Exception as e:
+        logger.warning(f"Driver-side JDBC warmup failed: {e}")
+
+    # Executor side: open and close one connection per executor slot
+    # so every worker completes its handshake before the first batch.
+    # Requires psycopg2 on the workers; skipped silently otherwise.
+    if PSYCOPG2_AVAILABLE:
+        host = Config.POSTGRES_HOST
+        port = Config.POSTGRES_PORT
+        dbname = Config.POSTGRES_DB
+        user = Config.POSTGRES_USER
+        password = Config.POSTGRES_PASSWORD
+
+        def _warm_partition(_rows):
+            import psycopg2 as pg
+            conn = pg.connect(
+                host=host, port=port, dbname=dbname,
+                user=user, password=password, connect_timeout=5
+            )
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            conn.close()
+
+        try:
+            num_slots = spark.sparkContext.defaultParallelism
+            spark.sparkContext \
+                .parallelize(range(num_slots), num_slots) \
+                .foreachPartition(_warm_partition)
+        except Exception as e:
+            logger.warning(f"Executor-side connection warmup failed: {e}")
+
+    logger.info("Connection pre-warm complete.")
+
 # ============================================================
 # Main Entry Point
 # ============================================================
 
+def _stop_spark(spark: SparkSession, streaming_started: bool):
+    """
+    Stop Spark without letting a failed startup hang the exit.
+
+    After a normal streaming run, spark.stop() is given however long
+    it needs: a loaded app can legitimately take more than a few
+    seconds to shut down cleanly, and killing it mid-stop would lose
+    buffered log output. Only when the streaming job never started is
+    there nothing to clean up, so that path stops just the underlying
+    SparkContext under a 10s watchdog that force-exits the process -
+    a restart-looping container should fail fast, not wait on
+    executor deregistration.
+    """
+    if streaming_started:
+        try:
+            spark.stop()
+            logger.info("Spark session stopped.")
+        except Exception as e:
+            logger.warning(f"Error while stopping Spark: {e}")
+        return
+
+    watchdog = threading.Timer(10.0, lambda: os._exit(1))
+    watchdog.daemon = True
+    watchdog.start()
+
+    try:
+        spark.sparkContext._jsc.sc().stop()
+        logger.info("Spark context stopped.")
+    except Exception as e:
+        logger.warning(f"Error while stopping Spark: {e}")
+    finally:
+        watchdog.cancel()
+
 def main():
     """Main function to run the streaming job."""
     logger.info("Initializing Spark Streaming to PostgreSQL pipeline...")
-    
-    # Create Spark session
-    spark = create_spark_session()
-    
+
+    # On a cold start, the Spark session (JVM startup) and PostgreSQL
+    # are both initializing at the same time. Overlap the two waits so
+    # startup takes max(spark, postgres) instead of their sum. The
+    # probe loop is Spark-free, so it can run on a worker thread.
+    with ThreadPoolExecutor(max_workers=2) as startup_pool:
+        spark_future = startup_pool.submit(create_spark_session)
+        postgres_future = startup_pool.submit(_wait_for_postgres_probe)
+
+        spark = spark_future.result()
+        postgres_ready = postgres_future.result()
+
+    streaming_started = False
+
     try:
-        # Wait for PostgreSQL to be ready
-        if not wait_for_postgres(spark):
+        # One-off Spark JDBC check once both sides are up
+        if not postgres_ready or not verify_jdbc_path(spark):
             logger.error("Cannot start streaming job - PostgreSQL unavailable")
             return
-        
+
+        # Warm up connections so the first batch isn't slowed by
+        # driver-class loading and connection handshakes
+        prewarm_postgres_connections(spark)
+
         # Start the streaming job
+        streaming_started = True
         start_streaming_job(spark)
-        
+
     except Exception as e:
-        logger.error(f"Streaming job failed: {e}")
+        logger.error("Streaming job failed: %s", e)
         raise
     finally:
-        spark.stop()
-        logger.info("Spark session stopped.")
+        _close_probe_connection()
+        _stop_spark(spark, streaming_started)
 
 if __name__ == "__main__":
     main()